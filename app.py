@@ -1,97 +1,24 @@
-import streamlit as st
-import pandas as pd
-import openai
-from openai import OpenAI
-import plotly.express as px
-import sqlite3
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.manifold import TSNE
-from sklearn.cluster import KMeans
+import math
 import os
+import streamlit as st
 from dotenv import load_dotenv
+import metrics
+from corpus import Corpus
+from worker import ThemeWorker, POLL_INTERVAL
+from theme_map import build_figure, MAX_SCATTER_POINTS
+from storage import initialize_database, ingest_comments, get_meta, has_comments, theme_counts, page_comments, load_replies
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-@st.cache_data
-def get_gpt_labels(comments, labels, n_clusters):
-    theme_names = []
-    for i in range(n_clusters):
-        cluster_texts = [comments[j] for j in range(len(comments)) if labels[j] == i]
-        prompt = f"""
-        Given the following comments, generate a 5-8 word label that captures key issues, including as many different keywords from the comments as possible. Output nothing but text, without quotes. Comments:
-        {cluster_texts}
-        Label:
-        """
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a semantic expert."},
-                {"role": "user", "content": prompt},
-            ],
-            max_completion_tokens=10000,
-            stop="###"
-        )
-        label = response.choices[0].message.content.strip()
-        theme_names.append(label)
-    return theme_names
-
-@st.cache_data
-def cluster_comments(comments, n_clusters=5):
-    if not comments or all(len(c.strip()) == 0 for c in comments):
-        raise ValueError("No valid comments for clustering.")
-    vectorizer = TfidfVectorizer(stop_words='english')
-    X = vectorizer.fit_transform(comments)
-    model = KMeans(n_clusters=n_clusters, random_state=16)
-    labels = model.fit_predict(X)
-    return labels, X.toarray()
-
-@st.cache_data
-def embed_comments(X):
-    tsne = TSNE(n_components=2, random_state=42)
-    embeddings = tsne.fit_transform(X)
-    return embeddings
-
-DB_FILE = "comments.db"
-TABLE_NAME = "comments"
-
-def initialize_database():
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute(f'''
-            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                comment TEXT,
-                reply TEXT,
-                upvotes INTEGER,
-                theme INTEGER,
-                theme_name TEXT,
-                x REAL,
-                y REAL
-            )
-        ''')
-        conn.commit()
-
-def load_comments():
-    with sqlite3.connect(DB_FILE) as conn:
-        df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME}", conn)
-    df['reply'] = df['reply'].apply(lambda x: eval(x) if isinstance(x, str) else [])
-    return df
-
-def save_comments(df):
-    df_copy = df.copy()
-    df_copy['reply'] = df_copy['reply'].apply(str)
-    with sqlite3.connect(DB_FILE) as conn:
-        conn.execute(f"DELETE FROM {TABLE_NAME}")
-        df_copy.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
-
-initialize_database()
-
-if 'comments_df' not in st.session_state:
-    try:
-        st.session_state.comments_df = load_comments()
-    except:
-        comments_data = [
+ONLINE_THEME_UPDATES = True
+PAGE_SIZE = 20
+SORT_OPTIONS = {"Top": "top", "Newest": "newest"}
+MAP_MODES = {"Sample by theme": "sample", "Density": "density"}
+
+@st.cache_resource
+def get_corpus():
+    initialize_database()
+    comments_data = [
     "I feel as if the world is fragmented. My need for unity is unmet — I don’t see the big picture, how everything is connected. Take political polarization: I have to manually do the cognitive work of filtering out people's extreme biases before I can extract the relevant information underneath. Nobody seems to agree on anything: as soon as I feel I have epistemic stability, where I have *some* stable foundations to stand on, the rug gets pulled out from under my feet. I don’t know what to believe.",
     "I don’t trust myself. I don’t trust my own instincts or observations or ideas or abilities. I don’t trust my ability to navigate the world — I’m always waiting for some external “objective” authority figure to free me from the burden of trusting my own judgement and the inherent uncertainty it comes with.",
     "I don’t know where I am. I’m an amalgamation of disparate, quickly evolving cultures that don’t give me strong enough answers or beliefs to navigate the world with.",
@@ -129,86 +56,129 @@ if 'comments_df' not in st.session_state:
     "There is a deep, pervading sickness in modern systems and culture — an output of unrestrained growth, systemic depravity, and deep isolation.",
     "Most people cannot articulate this precisely, but they feel that something fundamental is wrong — that a deep human need is not being met."
 ]
-        st.session_state.comments_df = pd.DataFrame({
-            'comment': comments_data,
-            'reply': [[] for _ in comments_data],
-            'upvotes': [0] * len(comments_data)
-        })
-
-comments = st.session_state.comments_df['comment'].tolist()
-if not comments or all(len(c.strip()) == 0 for c in comments):
+    # Runs once per process, and ingest_comments skips texts already stored,
+    # so sessions or processes starting on an empty database seed it only once.
+    if not has_comments():
+        ingest_comments([(c, 0, []) for c in comments_data])
+    return Corpus()
+
+@st.cache_resource
+def get_worker():
+    return ThemeWorker().start()
+
+@st.cache_resource(max_entries=4)
+def theme_map_figure(themed_version, layout_version, mode):
+    # Keyed on the versions the worker writes, so widget interactions reuse
+    # the built figure and only a new layout or theme assignment rebuilds it.
+    return build_figure(get_corpus().snapshot(), mode=mode)
+
+@st.cache_data(max_entries=4)
+def cached_theme_counts(data_version):
+    # Shared by every session and only re-queried after a write.
+    return theme_counts()
+
+def admin_panel():
+    with st.sidebar.expander("Pipeline timings", expanded=True):
+        stages = metrics.snapshot()
+        if stages:
+            st.dataframe(stages, hide_index=True, column_order=[
+                'stage', 'calls', 'last_seconds', 'max_seconds', 'total_seconds',
+                'items_per_second', 'prompt_tokens', 'completion_tokens', 'peak_rss_mb',
+            ])
+        else:
+            st.caption("No pipeline stages recorded yet.")
+        st.caption(f"Process peak RSS: {metrics.peak_rss_mb():.0f} MB · model v{worker.model.version} · themes v{get_meta('themed_version')}")
+        if worker.last_error is not None:
+            st.error(f"Last recompute failed: {worker.last_error!r}")
+
+@st.fragment(run_every=POLL_INTERVAL)
+def theme_status():
+    if get_meta('themed_version') != st.session_state.get('themed_version'):
+        st.rerun()
+    if worker.updating:
+        st.info("Themes updating… showing the last completed version.")
+
+corpus = get_corpus()
+
+
+if not has_comments():
     st.error("No valid comments available for clustering.")
     st.stop()
 
-labels, X = cluster_comments(comments)
-embeddings = embed_comments(X)
-
-theme_names = get_gpt_labels(comments, labels, n_clusters=5)
-
-st.session_state.comments_df['theme'] = labels
-st.session_state.comments_df['theme_name'] = [theme_names[label] for label in labels]
-st.session_state.comments_df['x'] = embeddings[:, 0]
-st.session_state.comments_df['y'] = embeddings[:, 1]
+worker = get_worker()
+st.session_state.themed_version = get_meta('themed_version')
+comments_df = corpus.snapshot()
 
 st.title("GENZ UNION")
 st.markdown("""*Generation Z, along with Millenials, comprise 48.5% of the total electorate of the United States. This means we have significant political power, if we can unite around material issues that we all face. Politicians may want to pit us against each other using partisan or identity rhetoric, but we look around us and we see the material reality: rising education, housing, living costs, stagnating wages, decreasing job opportunities, precarious employment in the face of technological disruption, loneliness pandemic and mental health crises, digital exploitation, ecological destabilization. These are issues that we can unionize and organize around, using our collective political power as a generation to bring about policy changes that ensure our generation can actually have a livable future.*""")
 st.success("This platform enables collective reflection and civic discourse around the unmet needs of our generation. Comments are clustered into themes for exploration.")
+theme_status()
+if os.getenv("ADMIN_PANEL"):
+    admin_panel()
 
 tab1, tab2, tab3 = st.tabs(["Discussion by Theme", "Theme Map", "Add Your Voice"])
 
 with tab1:
-    selected_theme_name = st.selectbox("Explore a theme:", sorted(st.session_state.comments_df['theme_name'].unique()))
-    filtered_comments = st.session_state.comments_df[st.session_state.comments_df['theme_name'] == selected_theme_name]
-
-    st.subheader(f"{selected_theme_name}")
-    for idx, row in filtered_comments.iterrows():
-        st.markdown(f"**User:** {row['comment']}")
-
-        col1, col2 = st.columns([1, 8])
-        with col1:
-            if st.button(f"⬆️ {row['upvotes']}", key=f"upvote_{idx}"):
-                st.session_state.comments_df.at[idx, 'upvotes'] += 1
-                save_comments(st.session_state.comments_df)
-                st.rerun()
-        with col2:
-
-            with st.expander("Reply / View Thread"):
-                for r in row['reply']:
-                    st.markdown(f"👉 {r}")
-                new_reply = st.text_area(f"Write a reply to comment {idx}", key=f"reply_{idx}")
-                if st.button(f"Submit Reply to {idx}"):
-                    st.session_state.comments_df.at[idx, 'reply'].append(new_reply)
-                    save_comments(st.session_state.comments_df)
-                    st.success("Reply submitted!")
+    counts = cached_theme_counts(corpus.version)
+    theme_labels = dict(zip(counts['theme'], counts['theme_name']))
+    theme_sizes = dict(zip(counts['theme'], counts['n_comments']))
+    # Streamlit derives widget identity from the label and the displayed
+    # options/limits, so those stay fixed; live counts and the page total go in
+    # a caption instead, or every new comment would reset the reader's choice.
+    selected_theme = st.selectbox(
+        "Explore a theme:", list(theme_labels),
+        format_func=lambda t: theme_labels[t], key="theme"
+    )
+
+    if selected_theme is not None:
+        st.subheader(f"{theme_labels[selected_theme]}")
+        sort_col, page_col = st.columns([3, 1])
+        with sort_col:
+            sort = st.radio("Sort by", list(SORT_OPTIONS), horizontal=True, key="sort")
+        with page_col:
+            n_pages = max(1, math.ceil(theme_sizes[selected_theme] / PAGE_SIZE))
+            page = min(st.number_input("Page", min_value=1, value=1, key=f"page_{selected_theme}"), n_pages)
+        st.caption(f"{theme_sizes[selected_theme]} comments · page {page} of {n_pages}")
+
+        page_df = page_comments(selected_theme, SORT_OPTIONS[sort], limit=PAGE_SIZE, offset=(page - 1) * PAGE_SIZE)
+        for row in page_df.itertuples():
+            st.markdown(f"**User:** {row.comment}")
+
+            col1, col2 = st.columns([1, 8])
+            with col1:
+                if st.button(f"⬆️ {row.upvotes}", key=f"upvote_{row.id}"):
+                    corpus.upvote(row.id)
+                    st.rerun()
+            with col2:
+                # Replies are only queried once the thread is opened.
+                if st.toggle(f"Reply / View Thread ({row.n_replies})", key=f"thread_{row.id}"):
+                    for r in load_replies(row.id):
+                        st.markdown(f"👉 {r}")
+                    new_reply = st.text_area(f"Write a reply to comment {row.id}", key=f"reply_{row.id}")
+                    if st.button(f"Submit Reply to {row.id}"):
+                        corpus.add_reply(row.id, new_reply)
+                        st.success("Reply submitted!")
 
 with tab2:
     st.subheader("Visual Map of Comments by Theme")
-    fig = px.scatter(
-        st.session_state.comments_df,
-        x='x', y='y',
-        color='theme_name',
-        hover_data=['comment', 'upvotes'],
-        title="Embedding Space of Comments with Thematic Clusters"
-    )
+    mode = 'sample'
+    if len(comments_df) > MAX_SCATTER_POINTS:
+        mode = MAP_MODES[st.radio("Large corpus view", list(MAP_MODES), horizontal=True)]
+    fig = theme_map_figure(get_meta('themed_version'), get_meta('layout_version'), mode)
     st.plotly_chart(fig, use_container_width=True)
+    if st.button("Recompute layout"):
+        worker.request(force_layout=True)
+        st.info("Layout recompute requested.")
 
 with tab3:
     st.subheader("Add Your Voice")
     new_comment = st.text_area("What is a need you feel is not being met?")
     if st.button("Submit Comment"):
-        new_label = cluster_comments([new_comment])[0][0]
-        theme_name = get_gpt_labels([new_comment], [new_label], 1)[0]
-        new_row = pd.DataFrame({
-            'comment': [new_comment],
-            'reply': [[]],
-            'upvotes': [0],
-            'theme': [new_label],
-            'theme_name': [theme_name],
-            'x': [0],
-            'y': [0]
-        })
-        st.session_state.comments_df = pd.concat([st.session_state.comments_df, new_row], ignore_index=True)
-        save_comments(st.session_state.comments_df)
-        st.success("Comment submitted and assigned to a theme!")
+        new_label, theme_name, new_x, new_y = worker.provisional(new_comment, update=ONLINE_THEME_UPDATES)
+        corpus.add_comment(new_comment, new_label, theme_name, new_x, new_y)
+        if new_label is None:
+            st.success("Comment submitted! It will be assigned to a theme shortly.")
+        else:
+            st.success("Comment submitted and assigned to a theme!")
 
 st.query_params.clear()
\ No newline at end of file
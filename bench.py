@@ -0,0 +1,146 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import types
+import metrics
+from storage import initialize_database, ingest_comments, upvote_comment, connection
+from worker import ThemeWorker
+
+TOPICS = {
+    'housing': "rent housing landlord mortgage eviction apartment roommates afford homeowner suburbs",
+    'work': "wages job career layoffs automation gig burnout salary precarious employer",
+    'loneliness': "lonely isolation friends community belonging connection strangers neighbors resonance alienation",
+    'climate': "climate ecological warming extraction future sustainability disaster emissions nature collapse",
+    'health': "mental anxiety depression therapy healthcare insurance opioids addiction suicide wellbeing",
+    'politics': "polarization democracy trust politicians vote media misinformation partisan institutions power",
+    'meaning': "meaning purpose virtue goodness integrity belief unity fragmented spiritual direction",
+}
+FILLER = "i feel that we really the it is and but because so much more not enough never always our generation".split()
+
+def synthetic_comments(n, seed=16):
+    rng = random.Random(seed)
+    pools = [words.split() for words in TOPICS.values()]
+    for i in range(n):
+        pool = pools[rng.randrange(len(pools))]
+        words = rng.choices(pool, k=rng.randint(4, 10)) + rng.choices(FILLER, k=rng.randint(6, 30))
+        rng.shuffle(words)
+        replies = [" ".join(rng.choices(FILLER + pool, k=8)) for _ in range(rng.randint(0, 2))] if i % 10 == 0 else []
+        yield f"{' '.join(words).capitalize()} (#{i})", rng.randint(0, 20), replies
+
+class FakeAsyncOpenAI:
+    # Offline stand-in for AsyncOpenAI: sleeps for the configured latency and
+    # reports token usage the way the real client does.
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=self)
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        prompt_tokens = sum(len(m['content']) for m in messages) // 4
+        return types.SimpleNamespace(
+            choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=f"Synthetic theme label {call}"))],
+            usage=types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=6),
+        )
+
+def _collect(size, phase, rows):
+    return [dict(row, size=size, phase=phase) for row in rows]
+
+def run_size(size, latency=0.5, batch_size=20000, n_votes=1000):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.db")
+        initialize_database(db_file)
+
+        metrics.reset()
+        batch = []
+        for record in synthetic_comments(size):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                with metrics.timed('ingest_comments', items=len(batch)):
+                    ingest_comments(batch, db_file=db_file)
+                batch = []
+        with metrics.timed('ingest_comments', items=len(batch)):
+            ingest_comments(batch, db_file=db_file)
+        with connection(db_file) as conn:
+            ids = [r[0] for r in conn.execute("SELECT id FROM comments ORDER BY random() LIMIT ?", (n_votes,))]
+        with metrics.timed('upvote_comment', items=len(ids)):
+            for comment_id in ids:
+                upvote_comment(comment_id, db_file=db_file)
+        results += _collect(size, 'write', metrics.snapshot())
+
+        worker = ThemeWorker(db_file=db_file, client=FakeAsyncOpenAI(latency))
+        metrics.reset()
+        worker.recompute()
+        results += _collect(size, 'cold', metrics.snapshot())
+
+        # Steady state: 1% new comments against an existing model and layout.
+        ingest_comments(list(synthetic_comments(max(1, size // 100), seed=size)), db_file=db_file)
+        metrics.reset()
+        worker.recompute()
+        results += _collect(size, 'incremental', metrics.snapshot())
+    return results
+
+def compare(current, baseline):
+    before = {(r['size'], r['phase'], r['stage']): r for r in baseline['results']}
+    print(f"{'size':>9} {'phase':<12} {'stage':<16} {'before s':>10} {'after s':>10} {'ratio':>7}", file=sys.stderr)
+    for r in current['results']:
+        old = before.get((r['size'], r['phase'], r['stage']))
+        if old is None:
+            continue
+        ratio = r['total_seconds'] / old['total_seconds'] if old['total_seconds'] else float('nan')
+        print(f"{r['size']:>9} {r['phase']:<12} {r['stage']:<16} {old['total_seconds']:>10.3f} {r['total_seconds']:>10.3f} {ratio:>7.2f}", file=sys.stderr)
+
+def summarize(report):
+    print(f"{'size':>9} {'phase':<12} {'stage':<16} {'seconds':>9} {'items/s':>12} {'peak MB':>8} {'tokens':>8}", file=sys.stderr)
+    for r in report['results']:
+        print(
+            f"{r['size']:>9} {r['phase']:<12} {r['stage']:<16} {r['total_seconds']:>9.3f} "
+            f"{r['items_per_second']:>12.0f} {r['peak_rss_mb']:>8.0f} {r['prompt_tokens'] + r['completion_tokens']:>8}",
+            file=sys.stderr,
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the comment pipeline on a synthetic corpus.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="corpus sizes to run; a full TSNE layout dominates above ~50k without openTSNE")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake OpenAI request")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'latency': args.latency,
+        },
+        'results': [],
+    }
+    # A fresh process per size so one size's allocations do not inflate the next.
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        with context.Pool(1) as pool:
+            report['results'] += pool.apply(run_size, (size, args.latency, args.batch_size))
+    summarize(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
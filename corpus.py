@@ -0,0 +1,64 @@
+import threading
+import pandas as pd
+from storage import DB_FILE, load_snapshot, get_versions, insert_comment, insert_comments, upvote_comment, add_reply
+
+class Corpus:
+    # One instance per process (see get_corpus in app.py). Sessions share the
+    # same read-only snapshot; every write goes through here and the database's
+    # version counters decide when the snapshot goes stale.
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        self.version = -1
+        self.comments_version = -1
+        self._snapshot = None
+        self._positions = None
+        self._lock = threading.RLock()
+
+    def _install(self, versions, df):
+        self.version, self.comments_version = versions
+        self._snapshot = df
+        self._positions = pd.Index(df['id'])
+
+    def refresh(self):
+        if get_versions(self.db_file)[0] != self.version:
+            with self._lock:
+                versions, df = load_snapshot(self.db_file)
+                if versions[0] != self.version:
+                    self._install(versions, df)
+        return self._snapshot
+
+    def snapshot(self):
+        return self.refresh()
+
+    def _patch(self, comment_id, column=None, value=None):
+        # Our own write is the only one since the last refresh: swap the one
+        # changed column into a shallow copy instead of re-reading the table.
+        with self._lock:
+            version, comments_version = get_versions(self.db_file)
+            if version != self.version + 1 or comment_id not in self._positions:
+                return
+            if column is None:
+                self.version = version
+                return
+            df = self._snapshot.copy(deep=False)
+            values = df[column].to_numpy().copy()
+            values[self._positions.get_loc(comment_id)] = value
+            df[column] = values
+            self._snapshot = df
+            self.version = version
+
+    def upvote(self, comment_id):
+        upvotes = upvote_comment(comment_id, db_file=self.db_file)
+        self._patch(comment_id, 'upvotes', upvotes)
+        return upvotes
+
+    def add_reply(self, comment_id, reply):
+        # Replies are not part of the snapshot; they are read per thread on demand.
+        add_reply(comment_id, reply, db_file=self.db_file)
+        self._patch(comment_id)
+
+    def add_comment(self, comment, theme=None, theme_name=None, x=None, y=None):
+        return insert_comment(comment, theme, theme_name, x, y, db_file=self.db_file)
+
+    def add_comments(self, comments):
+        insert_comments(comments, db_file=self.db_file)
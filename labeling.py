@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+import metrics
+from storage import DB_FILE, get_theme_labels, save_theme_labels
+
+LABEL_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = 1
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+N_REPRESENTATIVES = 25
+PROMPT_TOKEN_BUDGET = 2000
+LABEL_REUSE_OVERLAP = 0.8
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+class LabelingError(Exception):
+    # Raised once the labels that did succeed have been cached. names has them,
+    # with "Theme N" placeholders for the clusters whose requests failed.
+    def __init__(self, names, errors):
+        super().__init__(f"{len(errors)} label request(s) failed, first: {errors[0]!r}")
+        self.names = names
+        self.errors = errors
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text; close enough for a budget.
+    return len(text) // 4 + 1
+
+def cluster_key(texts):
+    digest = hashlib.sha256(f"{LABEL_MODEL}:{PROMPT_VERSION}".encode())
+    for text in sorted(texts):
+        digest.update(b"\0")
+        digest.update(text.encode())
+    return digest.hexdigest()
+
+def representative_texts(texts, features, k=N_REPRESENTATIVES, token_budget=PROMPT_TOKEN_BUDGET):
+    centroid = features.mean(axis=0)
+    order = np.argsort(np.linalg.norm(features - centroid, axis=1))
+    selected, used = [], 0
+    for i in order[:k]:
+        cost = estimate_tokens(texts[i])
+        if selected and used + cost > token_budget:
+            break
+        selected.append(texts[i])
+        used += cost
+    return selected
+
+def previous_labels(labels, old_themes, old_names, n_clusters, min_overlap=LABEL_REUSE_OVERLAP):
+    # A cluster whose members still mostly match one of the previously stored
+    # themes (Jaccard overlap) keeps that theme's name. A few new comments then
+    # neither trigger a relabel nor rename the theme under the reader.
+    labels = np.asarray(labels)
+    old_themes = np.asarray(old_themes, dtype=float)
+    old_names = np.asarray(old_names, dtype=object)
+    named = ~np.isnan(old_themes) & (old_names != None)
+    reused = {}
+    for i in range(n_clusters):
+        members = labels == i
+        candidates = old_themes[members & named]
+        if not len(candidates):
+            continue
+        values, counts = np.unique(candidates, return_counts=True)
+        previous = values[counts.argmax()]
+        was_member = named & (old_themes == previous)
+        overlap = counts.max() / (members.sum() + was_member.sum() - counts.max())
+        if overlap >= min_overlap:
+            reused[i] = old_names[was_member][0]
+    return reused
+
+def build_prompt(cluster_texts):
+    return f"""
+        Given the following comments, generate a 5-8 word label that captures key issues, including as many different keywords from the comments as possible. Output nothing but text, without quotes. Comments:
+        {cluster_texts}
+        Label:
+        """
+
+async def _request_label(client, semaphore, prompt):
+    async with semaphore:
+        for attempt in range(MAX_RETRIES):
+            try:
+                start = time.perf_counter()
+                response = await client.chat.completions.create(
+                    model=LABEL_MODEL,
+                    messages=[
+                        {"role": "system", "content": "You are a semantic expert."},
+                        {"role": "user", "content": prompt},
+                    ],
+                    max_completion_tokens=32,
+                    stop="###"
+                )
+                usage = getattr(response, 'usage', None)
+                metrics.record(
+                    'label_request', time.perf_counter() - start, items=1,
+                    prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                    completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                )
+                return response.choices[0].message.content.strip()
+            except RETRYABLE_ERRORS:
+                if attempt == MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt + random.uniform(0, RETRY_BACKOFF))
+
+async def label_clusters(comments, labels, features, n_clusters, reuse=None, client=None, db_file=DB_FILE):
+    labels = np.asarray(labels)
+    reuse = reuse or {}
+    members = [np.flatnonzero(labels == i) for i in range(n_clusters)]
+    keys = [None if i in reuse else cluster_key([comments[j] for j in idx]) for i, idx in enumerate(members)]
+    cached = get_theme_labels([k for k in keys if k], db_file=db_file)
+
+    pending = {}
+    for i, idx in enumerate(members):
+        if i in reuse or keys[i] in cached or not len(idx):
+            continue
+        texts = [comments[j] for j in idx]
+        pending[keys[i]] = build_prompt(representative_texts(texts, features[idx]))
+
+    errors = []
+    if pending:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        if client is None:
+            # Retries are handled by _request_label; the SDK's own would stack on top.
+            async with AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0) as owned_client:
+                results = await asyncio.gather(*(_request_label(owned_client, semaphore, p) for p in pending.values()), return_exceptions=True)
+        else:
+            results = await asyncio.gather(*(_request_label(client, semaphore, p) for p in pending.values()), return_exceptions=True)
+        fresh = {}
+        for key, result in zip(pending, results):
+            if isinstance(result, Exception):
+                errors.append(result)
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                fresh[key] = result
+        save_theme_labels(fresh, db_file=db_file)
+        cached.update(fresh)
+
+    names = [reuse.get(i) or cached.get(key, f"Theme {i + 1}") for i, key in enumerate(keys)]
+    if errors:
+        raise LabelingError(names, errors)
+    return names
+
+def get_gpt_labels(comments, labels, features, n_clusters, reuse=None, client=None, db_file=DB_FILE):
+    return asyncio.run(label_clusters(comments, labels, features, n_clusters, reuse=reuse, client=client, db_file=db_file))
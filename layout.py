@@ -0,0 +1,76 @@
+import numpy as np
+from sklearn.manifold import TSNE
+
+try:
+    from openTSNE import TSNE as OpenTSNE
+except ImportError:
+    OpenTSNE = None
+
+try:
+    from pynndescent import NNDescent
+except ImportError:
+    NNDescent = None
+
+RELAYOUT_GROWTH = 0.25
+N_NEIGHBORS = 10
+APPROX_NEIGHBORS_MIN = 50000
+
+def full_layout(features, random_state=42):
+    perplexity = min(30.0, max(1.0, (len(features) - 1) / 3))
+    if OpenTSNE is not None:
+        # FFT-accelerated gradients and approximate neighbours scale to far
+        # larger corpora than the exact-neighbour Barnes-Hut in scikit-learn.
+        tsne = OpenTSNE(perplexity=perplexity, neighbors='auto', negative_gradient_method='auto', n_jobs=-1, random_state=random_state)
+        return np.asarray(tsne.fit(features))
+    tsne = TSNE(n_components=2, perplexity=perplexity, method='barnes_hut', init='pca', random_state=random_state)
+    return tsne.fit_transform(features)
+
+def _normalize(features):
+    features = np.asarray(features, dtype=np.float32)
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return features / norms
+
+class NeighborIndex:
+    # Out-of-sample placement: each new point lands at the distance-weighted
+    # mean of its nearest already-laid-out neighbours in the LSA space. Rows
+    # are L2-normalised once when the index is built, so cosine neighbours
+    # come from a float32 matrix product per query chunk. Large layouts use an
+    # approximate pynndescent graph instead when it is installed.
+    def __init__(self, features, coords, n_neighbors=N_NEIGHBORS):
+        self.coords = np.asarray(coords)
+        self.n_neighbors = min(n_neighbors, len(self.coords))
+        self.features = _normalize(features)
+        self._approx = None
+        if NNDescent is not None and len(self.features) >= APPROX_NEIGHBORS_MIN:
+            self._approx = NNDescent(self.features, n_neighbors=max(15, self.n_neighbors), metric='cosine', random_state=16)
+
+    def _exact(self, queries, chunk_bytes=2 ** 28):
+        k = self.n_neighbors
+        chunk = max(1, chunk_bytes // (4 * len(self.features)))
+        indices = np.empty((len(queries), k), dtype=np.intp)
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), chunk):
+            similarity = queries[start:start + chunk] @ self.features.T
+            top = np.argpartition(similarity, -k, axis=1)[:, -k:]
+            indices[start:start + chunk] = top
+            distances[start:start + chunk] = 1.0 - np.take_along_axis(similarity, top, axis=1)
+        return indices, distances
+
+    def place(self, new_features):
+        queries = _normalize(new_features)
+        if self._approx is not None:
+            indices, distances = self._approx.query(queries, k=self.n_neighbors)
+        else:
+            indices, distances = self._exact(queries)
+        weights = 1.0 / (np.maximum(distances, 0) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum('ij,ijk->ik', weights, self.coords[indices])
+
+def place_points(known_features, known_coords, new_features, n_neighbors=N_NEIGHBORS):
+    return NeighborIndex(known_features, known_coords, n_neighbors=n_neighbors).place(new_features)
+
+def needs_relayout(layout_size, n_comments, growth=RELAYOUT_GROWTH):
+    if not layout_size:
+        return True
+    return n_comments - layout_size > growth * layout_size
@@ -0,0 +1,76 @@
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Process-wide per-stage counters. The worker, labeler and ingestion code
+# record into this; the admin panel in app.py and bench.py read it back.
+_stages = {}
+_lock = threading.Lock()
+RSS_SAMPLE_SECONDS = 0.05
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def rss_mb():
+    # Current resident set size. /proc is Linux-only; elsewhere the process
+    # peak so far is the closest figure the standard library offers.
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return peak_rss_mb()
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+def record(stage, seconds, items=0, prompt_tokens=0, completion_tokens=0, stage_rss_mb=None):
+    with _lock:
+        s = _stages.setdefault(stage, {
+            'stage': stage, 'calls': 0, 'total_seconds': 0.0, 'last_seconds': 0.0, 'max_seconds': 0.0,
+            'items': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+        })
+        s['calls'] += 1
+        s['total_seconds'] += seconds
+        s['last_seconds'] = seconds
+        s['max_seconds'] = max(s['max_seconds'], seconds)
+        s['items'] += items
+        s['prompt_tokens'] += prompt_tokens
+        s['completion_tokens'] += completion_tokens
+        s['peak_rss_mb'] = max(s.get('peak_rss_mb', 0.0), rss_mb() if stage_rss_mb is None else stage_rss_mb)
+
+@contextmanager
+def timed(stage, items=0):
+    # The yielded dict lets the caller fill in items once it knows the count.
+    # A sampler thread polls RSS while the stage runs, so peak_rss_mb is the
+    # highest RSS seen during this stage rather than over the process lifetime.
+    counts = {'items': items}
+    peak = [rss_mb()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], rss_mb())
+
+    sampler = threading.Thread(target=sample, name=f"rss-{stage}", daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        record(stage, seconds, items=counts['items'], stage_rss_mb=max(peak[0], rss_mb()))
+
+def snapshot():
+    with _lock:
+        rows = [dict(s) for s in _stages.values()]
+    for row in rows:
+        row['items_per_second'] = row['items'] / row['total_seconds'] if row['total_seconds'] else 0.0
+    return rows
+
+def reset():
+    with _lock:
+        _stages.clear()
@@ -1,5 +1,10 @@
-import sqlite3
-import pandas as pd
+import argparse
+import ast
+import csv
+import json
+import os
+from metrics import timed
+from storage import DB_FILE, initialize_database, connection, get_meta, ingest_comments
 
 # Your initial comments list
 comments_data = [
@@ -41,36 +46,72 @@ comments_data = [
     "Most people cannot articulate this precisely, but they feel that something fundamental is wrong — that a deep human need is not being met."
 ]
 
-# Create initial DataFrame
-df = pd.DataFrame({
-    'comment': comments_data,
-    'reply': [[] for _ in comments_data],
-    'upvotes': [0] * len(comments_data),
-    'theme': [0] * len(comments_data),          # dummy placeholders
-    'theme_name': [''] * len(comments_data),    # will be set later by app
-    'x': [0.0] * len(comments_data),            # will be set by embedding
-    'y': [0.0] * len(comments_data),
-})
+def parse_replies(value):
+    # JSON arrays are the export format, but dumps of older databases carry
+    # the legacy str(list) form, read the same way _migrate_legacy_replies does.
+    if not value:
+        return []
+    if isinstance(value, list):
+        return value
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError:
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            parsed = [value]
+    return [str(r) for r in parsed] if isinstance(parsed, (list, tuple)) else [str(parsed)]
 
-# Save to SQLite
-DB_FILE = "comments.db"
-TABLE_NAME = "comments"
+def read_records(path):
+    if path.endswith(('.jsonl', '.ndjson')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
 
-with sqlite3.connect(DB_FILE) as conn:
-    conn.execute(f'''
-        CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            comment TEXT,
-            reply TEXT,
-            upvotes INTEGER,
-            theme INTEGER,
-            theme_name TEXT,
-            x REAL,
-            y REAL
-        )
-    ''')
-    df['reply'] = df['reply'].apply(str)
-    conn.execute(f"DELETE FROM {TABLE_NAME}")  # optional: clear table before insert
-    df.to_sql(TABLE_NAME, conn, if_exists='append', index=False)
+def to_record(row):
+    return (
+        row['comment'],
+        int(row.get('upvotes') or 0),
+        parse_replies(row.get('replies', row.get('reply'))),
+    )
 
-print(f"Inserted {len(df)} comments into {DB_FILE}.")
+def ingest_file(path, batch_size=5000, resume=True, db_file=DB_FILE):
+    checkpoint_key = f"ingest:{os.path.abspath(path)}"
+    done = int(get_meta(checkpoint_key, 0, db_file=db_file)) if resume else 0
+    inserted, batch, position = 0, [], done
+    for position, row in enumerate(read_records(path), start=1):
+        if position <= done:
+            continue
+        if not (row.get('comment') or '').strip():
+            continue
+        batch.append(to_record(row))
+        if len(batch) >= batch_size:
+            with timed('ingest_comments', items=len(batch)):
+                inserted += ingest_comments(batch, checkpoint=(checkpoint_key, position), db_file=db_file)
+            print(f"{position} records read, {inserted} comments inserted")
+            batch = []
+    with timed('ingest_comments', items=len(batch)):
+        inserted += ingest_comments(batch, checkpoint=(checkpoint_key, position), db_file=db_file)
+    return inserted
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load comments into the database.")
+    parser.add_argument("path", nargs="?", help="CSV or JSONL file with a 'comment' column; defaults to the built-in comments")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint and read the file from the start")
+    args = parser.parse_args()
+
+    initialize_database(args.db)
+    # The CLI is single-threaded, so every batch gets this same pooled connection back.
+    with connection(args.db) as conn:
+        conn.execute("PRAGMA cache_size=-65536")
+    if args.path:
+        inserted = ingest_file(args.path, batch_size=args.batch_size, resume=not args.restart, db_file=args.db)
+    else:
+        inserted = ingest_comments([(c, 0, []) for c in comments_data], db_file=args.db)
+    print(f"Inserted {inserted} comments into {args.db}.")
@@ -0,0 +1,322 @@
+import ast
+import hashlib
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+DB_FILE = "comments.db"
+TABLE_NAME = "comments"
+REPLIES_TABLE = "replies"
+META_TABLE = "meta"
+LABELS_TABLE = "theme_labels"
+
+# Connections are pooled per database for the whole process. Streamlit runs
+# every rerun on a fresh script thread, so thread-local connections would be
+# reopened (and their PRAGMAs re-issued) on each click; the pool hands idle
+# connections to whichever thread asks next. A thread that already holds a
+# connection gets the same one back, so nested calls share its transaction.
+_pools = {}
+_pools_lock = threading.Lock()
+_held = threading.local()
+
+def _connect(db_file):
+    conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+@contextmanager
+def connection(db_file=DB_FILE):
+    held = getattr(_held, "connections", None)
+    if held is None:
+        held = _held.connections = {}
+    if db_file in held:
+        yield held[db_file]
+        return
+    with _pools_lock:
+        pool = _pools.setdefault(db_file, queue.LifoQueue())
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = _connect(db_file)
+    held[db_file] = conn
+    try:
+        yield conn
+    finally:
+        del held[db_file]
+        pool.put(conn)
+
+SCHEMA_VERSION = 2
+
+def initialize_database(db_file=DB_FILE):
+    # WAL is stored in the database file, so setting it once here covers every
+    # later connection and lets readers proceed while another thread writes.
+    with connection(db_file) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+    with connection(db_file) as conn, conn:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                comment TEXT,
+                reply TEXT,
+                upvotes INTEGER,
+                theme INTEGER,
+                theme_name TEXT,
+                x REAL,
+                y REAL,
+                content_hash INTEGER
+            )
+        ''')
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {REPLIES_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                comment_id INTEGER NOT NULL REFERENCES {TABLE_NAME}(id),
+                reply TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {LABELS_TABLE} (
+                key TEXT PRIMARY KEY,
+                label TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # The data migrations scan the whole comments table, so they run once
+        # per database and are recorded in meta rather than on every startup.
+        if int(get_meta('schema_version', 0, db_file=db_file)) < SCHEMA_VERSION:
+            _migrate_content_hash(conn)
+            _migrate_legacy_replies(conn)
+            _set_meta(conn, {'schema_version': SCHEMA_VERSION})
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_replies_comment ON {REPLIES_TABLE}(comment_id, id)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_comments_theme_upvotes ON {TABLE_NAME}(theme, upvotes DESC, id DESC)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_comments_theme_id ON {TABLE_NAME}(theme, id DESC)")
+        # Covers theme_counts, which otherwise reads every row for theme_name.
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_comments_theme_name ON {TABLE_NAME}(theme, theme_name)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_comments_content_hash ON {TABLE_NAME}(content_hash)")
+
+def content_hash(comment):
+    # First 64 bits of the SHA-256 as a signed integer: collisions are
+    # negligible at corpus sizes we care about and the index stays small.
+    return int.from_bytes(hashlib.sha256(comment.strip().encode()).digest()[:8], 'big', signed=True)
+
+def _migrate_content_hash(conn):
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")}
+    if 'content_hash' not in columns:
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN content_hash INTEGER")
+    rows = conn.execute(f"SELECT id, comment FROM {TABLE_NAME} WHERE content_hash IS NULL").fetchall()
+    conn.executemany(
+        f"UPDATE {TABLE_NAME} SET content_hash = ? WHERE id = ?",
+        [(content_hash(comment or ""), comment_id) for comment_id, comment in rows],
+    )
+
+def _migrate_legacy_replies(conn):
+    # Older databases kept replies as a stringified Python list in comments.reply.
+    rows = conn.execute(
+        f"SELECT id, reply FROM {TABLE_NAME} WHERE reply IS NOT NULL AND reply NOT IN ('', '[]')"
+    ).fetchall()
+    replies = []
+    for comment_id, reply in rows:
+        try:
+            parsed = ast.literal_eval(reply)
+        except (ValueError, SyntaxError):
+            parsed = [reply]
+        replies.extend((comment_id, str(r)) for r in parsed)
+    if rows:
+        conn.executemany(f"INSERT INTO {REPLIES_TABLE} (comment_id, reply) VALUES (?, ?)", replies)
+        conn.executemany(f"UPDATE {TABLE_NAME} SET reply = NULL WHERE id = ?", [(r[0],) for r in rows])
+
+def get_meta(key, default=None, db_file=DB_FILE):
+    with connection(db_file) as conn:
+        row = conn.execute(f"SELECT value FROM {META_TABLE} WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+def _set_meta(conn, values):
+    conn.executemany(
+        f"INSERT INTO {META_TABLE} (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        [(k, str(v)) for k, v in values.items()],
+    )
+
+def _bump_versions(conn, comments=False):
+    # data_version moves on every write; comments_version only when the set of
+    # comment texts changes, which is all the clustering pipeline depends on.
+    keys = ['data_version', 'comments_version'] if comments else ['data_version']
+    conn.executemany(
+        f"INSERT INTO {META_TABLE} (key, value) VALUES (?, 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+        [(k,) for k in keys],
+    )
+
+def get_versions(db_file=DB_FILE):
+    with connection(db_file) as conn:
+        rows = dict(conn.execute(
+            f"SELECT key, value FROM {META_TABLE} WHERE key IN ('data_version', 'comments_version')"
+        ).fetchall())
+    return int(rows.get('data_version', 0)), int(rows.get('comments_version', 0))
+
+def load_comments(db_file=DB_FILE, replies=True):
+    with connection(db_file) as conn:
+        df = pd.read_sql_query(
+            f"SELECT id, comment, upvotes, theme, theme_name, x, y FROM {TABLE_NAME} ORDER BY id", conn
+        )
+        reply_rows = pd.read_sql_query(f"SELECT comment_id, reply FROM {REPLIES_TABLE} ORDER BY id", conn) if replies else None
+    df['upvotes'] = df['upvotes'].fillna(0).astype(int)
+    if reply_rows is None:
+        return df
+    grouped = reply_rows.groupby('comment_id')['reply'].agg(list).to_dict()
+    df['reply'] = [grouped.get(i, []) for i in df['id']]
+    return df
+
+def load_snapshot(db_file=DB_FILE):
+    # Reads the versions and the rows inside one WAL read transaction so the
+    # returned frame is exactly the state those versions describe.
+    with connection(db_file) as conn:
+        conn.execute("BEGIN")
+        try:
+            versions = get_versions(db_file)
+            df = load_comments(db_file, replies=False)
+        finally:
+            conn.commit()
+    return versions, df
+
+def has_comments(db_file=DB_FILE):
+    with connection(db_file) as conn:
+        row = conn.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {TABLE_NAME} WHERE TRIM(comment, char(32, 9, 10, 13)) != '')"
+        ).fetchone()
+    return bool(row[0])
+
+SORT_ORDERS = {
+    'top': "upvotes DESC, id DESC",
+    'newest': "id DESC",
+}
+
+def theme_counts(db_file=DB_FILE):
+    with connection(db_file) as conn:
+        return pd.read_sql_query(
+            f"SELECT theme, MAX(theme_name) AS theme_name, COUNT(*) AS n_comments "
+            f"FROM {TABLE_NAME} WHERE theme IS NOT NULL GROUP BY theme ORDER BY theme_name",
+            conn,
+        )
+
+def page_comments(theme, sort='top', limit=20, offset=0, db_file=DB_FILE):
+    with connection(db_file) as conn:
+        return pd.read_sql_query(
+            f"SELECT c.id, c.comment, COALESCE(c.upvotes, 0) AS upvotes, "
+            f"(SELECT COUNT(*) FROM {REPLIES_TABLE} r WHERE r.comment_id = c.id) AS n_replies "
+            f"FROM {TABLE_NAME} c WHERE c.theme = ? ORDER BY {SORT_ORDERS[sort]} LIMIT ? OFFSET ?",
+            conn,
+            params=(int(theme), int(limit), int(offset)),
+        )
+
+def load_replies(comment_id, db_file=DB_FILE):
+    with connection(db_file) as conn:
+        rows = conn.execute(
+            f"SELECT reply FROM {REPLIES_TABLE} WHERE comment_id = ? ORDER BY id", (comment_id,)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+def insert_comment(comment, theme=None, theme_name=None, x=None, y=None, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        cursor = conn.execute(
+            f"INSERT INTO {TABLE_NAME} (comment, upvotes, theme, theme_name, x, y, content_hash) VALUES (?, 0, ?, ?, ?, ?, ?)",
+            (comment, theme, theme_name, x, y, content_hash(comment)),
+        )
+        _bump_versions(conn, comments=True)
+    return cursor.lastrowid
+
+def insert_comments(comments, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        conn.executemany(
+            f"INSERT INTO {TABLE_NAME} (comment, upvotes, content_hash) VALUES (?, 0, ?)",
+            [(c, content_hash(c)) for c in comments],
+        )
+        _bump_versions(conn, comments=True)
+
+def _select_by_hash(conn, columns, hashes, chunk_size=500):
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        yield from conn.execute(
+            f"SELECT {columns} FROM {TABLE_NAME} WHERE content_hash IN ({', '.join('?' * len(chunk))})", chunk
+        )
+
+def _existing_hashes(conn, hashes):
+    return {row[0] for row in _select_by_hash(conn, "content_hash", hashes)}
+
+def ingest_comments(records, checkpoint=None, db_file=DB_FILE):
+    # Bulk path for save.py. records are (comment, upvotes, replies) tuples.
+    # Comments whose content hash is already stored, or repeated within the
+    # batch, are skipped along with their replies, so re-running a file is a
+    # no-op. The checkpoint is written in the same transaction as the rows.
+    batch = {}
+    for comment, upvotes, replies in records:
+        batch.setdefault(content_hash(comment), (comment, upvotes, replies))
+    with connection(db_file) as conn, conn:
+        # Take the write lock before the existence check so concurrent
+        # ingests (e.g. two processes seeding an empty database) can't both insert.
+        conn.execute("BEGIN IMMEDIATE")
+        existing = _existing_hashes(conn, list(batch))
+        fresh = [h for h in batch if h not in existing]
+        conn.executemany(
+            f"INSERT INTO {TABLE_NAME} (comment, upvotes, content_hash) VALUES (?, ?, ?)",
+            [(batch[h][0], batch[h][1], h) for h in fresh],
+        )
+        threaded = [h for h in fresh if batch[h][2]]
+        ids = dict(_select_by_hash(conn, "content_hash, id", threaded))
+        conn.executemany(
+            f"INSERT INTO {REPLIES_TABLE} (comment_id, reply) VALUES (?, ?)",
+            [(ids[h], str(r)) for h in threaded for r in batch[h][2]],
+        )
+        if checkpoint:
+            _set_meta(conn, dict([checkpoint]))
+        if fresh:
+            _bump_versions(conn, comments=True)
+    return len(fresh)
+
+def upvote_comment(comment_id, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        row = conn.execute(
+            f"UPDATE {TABLE_NAME} SET upvotes = COALESCE(upvotes, 0) + 1 WHERE id = ? RETURNING upvotes",
+            (comment_id,),
+        ).fetchone()
+        _bump_versions(conn)
+    return row[0] if row else None
+
+def add_reply(comment_id, reply, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        conn.execute(
+            f"INSERT INTO {REPLIES_TABLE} (comment_id, reply) VALUES (?, ?)",
+            (comment_id, reply),
+        )
+        _bump_versions(conn)
+
+def update_themes(ids, themes, theme_names, coords, meta=None, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        conn.executemany(
+            f"UPDATE {TABLE_NAME} SET theme = ?, theme_name = ?, x = ?, y = ? WHERE id = ?",
+            [(int(t), n, float(x), float(y), int(i)) for i, t, n, (x, y) in zip(ids, themes, theme_names, coords)],
+        )
+        if meta:
+            _set_meta(conn, meta)
+        _bump_versions(conn)
+
+def get_theme_labels(keys, db_file=DB_FILE):
+    keys = list(keys)
+    if not keys:
+        return {}
+    placeholders = ", ".join("?" * len(keys))
+    with connection(db_file) as conn:
+        rows = conn.execute(
+            f"SELECT key, label FROM {LABELS_TABLE} WHERE key IN ({placeholders})", keys
+        ).fetchall()
+    return dict(rows)
+
+def save_theme_labels(labels, db_file=DB_FILE):
+    with connection(db_file) as conn, conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO {LABELS_TABLE} (key, label) VALUES (?, ?)",
+            list(labels.items()),
+        )
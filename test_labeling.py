@@ -0,0 +1,149 @@
+import asyncio
+import types
+import httpx
+import numpy as np
+import openai
+import pytest
+import labeling
+from storage import initialize_database
+
+class FakeClient:
+    # Offline stand-in for AsyncOpenAI. Raises the queued errors first, then
+    # answers, and keeps track of how many requests were in flight at once.
+    def __init__(self, errors=(), latency=0.01):
+        self.errors = list(errors)
+        self.latency = latency
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = types.SimpleNamespace(completions=self)
+
+    async def create(self, model, messages, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.errors:
+                raise self.errors.pop(0)
+            return types.SimpleNamespace(
+                choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=f" Label {self.calls} "))],
+                usage=types.SimpleNamespace(prompt_tokens=10, completion_tokens=3),
+            )
+        finally:
+            self.in_flight -= 1
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+def corpus(n_clusters, per_cluster=4):
+    comments = [f"comment {i} about topic {i % n_clusters}" for i in range(n_clusters * per_cluster)]
+    labels = np.arange(len(comments)) % n_clusters
+    features = np.random.default_rng(0).standard_normal((len(comments), 3))
+    return comments, labels, features
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "comments.db")
+    initialize_database(path)
+    return path
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(labeling, 'RETRY_BACKOFF', 0.0)
+
+def test_concurrency_is_capped(db_file):
+    client = FakeClient()
+    comments, labels, features = corpus(labeling.MAX_CONCURRENCY * 3)
+    names = labeling.get_gpt_labels(comments, labels, features, n_clusters=len(set(labels)), client=client, db_file=db_file)
+    assert client.calls == len(names) == labeling.MAX_CONCURRENCY * 3
+    assert client.max_in_flight == labeling.MAX_CONCURRENCY
+
+def test_rate_limit_is_retried(db_file):
+    client = FakeClient(errors=[rate_limit_error()] * (labeling.MAX_RETRIES - 1))
+    comments, labels, features = corpus(1)
+    assert labeling.get_gpt_labels(comments, labels, features, n_clusters=1, client=client, db_file=db_file) == [f"Label {labeling.MAX_RETRIES}"]
+    assert client.calls == labeling.MAX_RETRIES
+
+def test_rate_limit_is_raised_after_max_retries(db_file):
+    client = FakeClient(errors=[rate_limit_error()] * labeling.MAX_RETRIES)
+    comments, labels, features = corpus(1)
+    with pytest.raises(labeling.LabelingError) as raised:
+        labeling.get_gpt_labels(comments, labels, features, n_clusters=1, client=client, db_file=db_file)
+    assert client.calls == labeling.MAX_RETRIES
+    assert isinstance(raised.value.errors[0], openai.RateLimitError)
+
+def test_failed_cluster_keeps_other_labels(db_file):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    rejected = openai.BadRequestError("content filter", response=httpx.Response(400, request=request), body=None)
+    comments, labels, features = corpus(3)
+    with pytest.raises(labeling.LabelingError) as raised:
+        labeling.get_gpt_labels(comments, labels, features, n_clusters=3, client=FakeClient(errors=[rejected]), db_file=db_file)
+    assert len(raised.value.errors) == 1
+    assert sum(name.startswith("Theme ") for name in raised.value.names) == 1
+    # The two labels that succeeded were cached; only the failed cluster is asked again.
+    client = FakeClient()
+    names = labeling.get_gpt_labels(comments, labels, features, n_clusters=3, client=client, db_file=db_file)
+    assert client.calls == 1
+    assert [n for n in raised.value.names if not n.startswith("Theme ")] == [n for n, old in zip(names, raised.value.names) if not old.startswith("Theme ")]
+
+def test_owned_client_disables_sdk_retries(db_file, monkeypatch):
+    created = {}
+
+    class OwnedClient(FakeClient):
+        def __init__(self, **kwargs):
+            super().__init__()
+            created.update(kwargs)
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(labeling, 'AsyncOpenAI', OwnedClient)
+    comments, labels, features = corpus(1)
+    labeling.get_gpt_labels(comments, labels, features, n_clusters=1, db_file=db_file)
+    assert created['max_retries'] == 0
+
+def test_unchanged_membership_hits_cache(db_file):
+    comments, labels, features = corpus(3)
+    first = labeling.get_gpt_labels(comments, labels, features, n_clusters=3, client=FakeClient(), db_file=db_file)
+    client = FakeClient()
+    # Same members in a different order and position still hash to the same key.
+    order = np.random.default_rng(1).permutation(len(comments))
+    second = labeling.get_gpt_labels([comments[i] for i in order], labels[order], features[order], n_clusters=3, client=client, db_file=db_file)
+    assert client.calls == 0
+    assert second == first
+
+def test_empty_cluster_gets_placeholder(db_file):
+    client = FakeClient()
+    comments, labels, features = corpus(2)
+    names = labeling.get_gpt_labels(comments, labels, features, n_clusters=3, client=client, db_file=db_file)
+    assert client.calls == 2
+    assert names[2] == "Theme 3"
+
+def test_representatives_respect_token_budget():
+    texts = [f"{i} " + "word " * 200 for i in range(50)]
+    features = np.random.default_rng(0).standard_normal((len(texts), 5))
+    selected = labeling.representative_texts(texts, features)
+    assert 0 < len(selected) < labeling.N_REPRESENTATIVES
+    assert sum(labeling.estimate_tokens(t) for t in selected) <= labeling.PROMPT_TOKEN_BUDGET
+
+def test_representatives_are_closest_to_centroid():
+    texts = ["near", "far", "middle"]
+    features = np.array([[0.1, 0.0], [10.0, 10.0], [-2.0, -1.0]])
+    assert labeling.representative_texts(texts, features, k=2) == ["near", "middle"]
+
+def test_previous_label_is_reused_for_small_changes():
+    labels = np.array([0, 0, 0, 0, 0, 1, 1, 1, 1, 1])
+    old_themes = np.array([1, 1, 1, 1, np.nan, 0, 0, 0, 0, 0])
+    old_names = np.array(["Housing"] * 4 + [None] + ["Work"] * 5, dtype=object)
+    assert labeling.previous_labels(labels, old_themes, old_names, n_clusters=2) == {0: "Housing", 1: "Work"}
+
+def test_previous_label_is_dropped_after_a_split():
+    labels = np.array([0, 0, 1, 1])
+    old_themes = np.array([0, 0, 0, 0])
+    old_names = np.array(["Housing"] * 4, dtype=object)
+    assert labeling.previous_labels(labels, old_themes, old_names, n_clusters=2) == {}
@@ -0,0 +1,69 @@
+import csv
+import pytest
+import save
+from storage import initialize_database, get_meta, load_comments, load_replies
+
+@pytest.fixture
+def db_file(tmp_path):
+    path = str(tmp_path / "comments.db")
+    initialize_database(path)
+    return path
+
+def write_csv(path, n):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["comment", "upvotes", "replies"])
+        writer.writeheader()
+        for i in range(n):
+            writer.writerow({"comment": f"comment {i}", "upvotes": i, "replies": '["first", "second"]' if i % 3 == 0 else ""})
+    return str(path)
+
+def test_rerunning_a_file_inserts_nothing(db_file, tmp_path):
+    path = write_csv(tmp_path / "comments.csv", 25)
+    assert save.ingest_file(path, batch_size=10, db_file=db_file) == 25
+    assert save.ingest_file(path, batch_size=10, resume=False, db_file=db_file) == 0
+    df = load_comments(db_file)
+    assert len(df) == 25
+    assert df['reply'].map(len).sum() == 2 * 9
+
+def test_interrupted_load_resumes_from_checkpoint(db_file, tmp_path, monkeypatch):
+    path = write_csv(tmp_path / "comments.csv", 25)
+    ingest = save.ingest_comments
+    batches = []
+
+    def fail_on_second_batch(records, **kwargs):
+        batches.append(len(records))
+        if len(batches) == 2:
+            raise KeyboardInterrupt
+        return ingest(records, **kwargs)
+
+    monkeypatch.setattr(save, 'ingest_comments', fail_on_second_batch)
+    with pytest.raises(KeyboardInterrupt):
+        save.ingest_file(path, batch_size=10, db_file=db_file)
+    checkpoint_key = f"ingest:{tmp_path / 'comments.csv'}"
+    assert get_meta(checkpoint_key, db_file=db_file) == "10"
+
+    batches.clear()
+    monkeypatch.setattr(save, 'ingest_comments', lambda records, **kwargs: batches.append(len(records)) or ingest(records, **kwargs))
+    assert save.ingest_file(path, batch_size=10, db_file=db_file) == 15
+    # Only the rows after the checkpoint were read again.
+    assert batches == [10, 5]
+    assert len(load_comments(db_file)) == 25
+    assert get_meta(checkpoint_key, db_file=db_file) == "25"
+
+@pytest.mark.parametrize("value, expected", [
+    ('["a", "it\'s"]', ["a", "it's"]),
+    ("['a', \"it's\"]", ["a", "it's"]),
+    ("not a list", ["not a list"]),
+    ("", []),
+])
+def test_parse_replies_accepts_json_and_legacy_lists(value, expected):
+    assert save.parse_replies(value) == expected
+
+def test_legacy_reply_column_is_loaded(db_file, tmp_path):
+    path = tmp_path / "export.csv"
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["comment", "upvotes", "reply"])
+        writer.writeheader()
+        writer.writerow({"comment": "legacy", "upvotes": 1, "reply": "['a', \"it's\"]"})
+    assert save.ingest_file(str(path), db_file=db_file) == 1
+    assert load_replies(int(load_comments(db_file)['id'][0]), db_file=db_file) == ["a", "it's"]
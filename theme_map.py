@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.express as px
+
+MAX_SCATTER_POINTS = 10000
+HOVER_CHARS = 200
+DENSITY_BINS = 120
+TITLE = "Embedding Space of Comments with Thematic Clusters"
+
+def stratified_sample(df, max_points, random_state=16):
+    # Every theme keeps a share proportional to its size, with a floor so
+    # small themes stay visible next to large ones.
+    if len(df) <= max_points:
+        return df
+    groups = df.groupby('theme_name', dropna=False)
+    floor = max(1, max_points // (20 * max(1, groups.ngroups)))
+    parts = []
+    for _, group in groups:
+        n = min(len(group), max(floor, round(max_points * len(group) / len(df))))
+        parts.append(group.sample(n=n, random_state=random_state))
+    return pd.concat(parts)
+
+def hover_text(df):
+    comments = df['comment'].str.slice(0, HOVER_CHARS)
+    return comments.str.cat(df['upvotes'].astype(str), sep="<br>⬆️ ")
+
+def scatter_figure(df, title=TITLE):
+    fig = go.Figure()
+    colors = px.colors.qualitative.Plotly
+    for i, (theme_name, group) in enumerate(df.groupby('theme_name', dropna=False, sort=True)):
+        fig.add_trace(go.Scattergl(
+            x=group['x'], y=group['y'],
+            mode='markers',
+            name=str(theme_name),
+            marker=dict(size=6, color=colors[i % len(colors)]),
+            text=hover_text(group),
+            hovertemplate="%{text}<extra>%{fullData.name}</extra>",
+        ))
+    fig.update_layout(title=title, legend_title_text='theme_name')
+    return fig
+
+def density_figure(df, title=TITLE):
+    # Binned here rather than with go.Histogram2d, which would still ship
+    # every raw point to the browser.
+    counts, x_edges, y_edges = np.histogram2d(df['x'], df['y'], bins=DENSITY_BINS)
+    fig = go.Figure(go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2, y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=np.where(counts > 0, counts, np.nan).T,
+        colorscale='Viridis',
+        hovertemplate="%{z} comments<extra></extra>",
+    ))
+    # Label each theme at its centroid so the aggregated view stays readable.
+    centers = df.groupby('theme_name')[['x', 'y']].median()
+    fig.add_trace(go.Scattergl(
+        x=centers['x'], y=centers['y'],
+        mode='text', text=centers.index, textfont=dict(color='white'),
+        hoverinfo='skip', showlegend=False,
+    ))
+    fig.update_layout(title=title)
+    return fig
+
+def build_figure(df, mode='sample', max_points=MAX_SCATTER_POINTS):
+    df = df.dropna(subset=['x', 'y'])
+    if len(df) <= max_points:
+        return scatter_figure(df)
+    if mode == 'density':
+        return density_figure(df)
+    sample = stratified_sample(df, max_points)
+    return scatter_figure(sample, title=f"{TITLE} ({len(sample):,} of {len(df):,} shown)")
@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from storage import DB_FILE
+
+logger = logging.getLogger(__name__)
+
+MODEL_FORMAT = 3
+
+def model_path(db_file=DB_FILE):
+    return os.path.splitext(db_file)[0] + "_themes.joblib"
+
+class ThemeModel:
+    def __init__(self, n_clusters=5, n_components=100, dtype=np.float32, drift_threshold=1.25, min_drift_samples=10, refit_growth=0.25):
+        self.n_clusters = n_clusters
+        self.n_components = n_components
+        self.dtype = dtype
+        self.drift_threshold = drift_threshold
+        self.min_drift_samples = min_drift_samples
+        self.refit_growth = refit_growth
+        self.version = 0
+        self.vectorizer = None
+        self.kmeans = None
+        self.svd = None
+        self.n_fit_docs = 0
+        self.baseline_distance = 0.0
+        self.n_updates = 0
+        self.update_distance = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def is_fitted(self):
+        return self.kmeans is not None
+
+    @property
+    def drift(self):
+        if not self.n_updates or not self.baseline_distance:
+            return 0.0
+        return (self.update_distance / self.n_updates) / self.baseline_distance
+
+    @property
+    def needs_refit(self):
+        if self.n_fit_docs and self.n_updates > self.refit_growth * self.n_fit_docs:
+            return True
+        return self.n_updates >= self.min_drift_samples and self.drift > self.drift_threshold
+
+    def fit(self, comments):
+        if not comments or all(len(c.strip()) == 0 for c in comments):
+            raise ValueError("No valid comments for clustering.")
+        with self._lock:
+            vectorizer = TfidfVectorizer(stop_words='english', dtype=self.dtype)
+            X = vectorizer.fit_transform(comments)
+            kmeans = MiniBatchKMeans(n_clusters=min(self.n_clusters, X.shape[0]), random_state=16, n_init=3)
+            labels = kmeans.fit_predict(X)
+            n_components = max(1, min(self.n_components, X.shape[0] - 1, X.shape[1] - 1))
+            svd = TruncatedSVD(n_components=n_components, random_state=16).fit(X)
+            self.vectorizer = vectorizer
+            self.kmeans = kmeans
+            self.svd = svd
+            self.version += 1
+            self.n_fit_docs = X.shape[0]
+            self.baseline_distance = float(self._distances(X).mean())
+            self.n_updates = 0
+            self.update_distance = 0.0
+        return labels
+
+    def _distances(self, X):
+        # Cosine distance to the nearest centroid. Comments made entirely of
+        # out-of-vocabulary words come out at 1.0 rather than close to every centroid.
+        centers = self.kmeans.cluster_centers_
+        norms = np.linalg.norm(centers, axis=1)
+        norms[norms == 0] = 1.0
+        similarity = np.asarray(X @ (centers / norms[:, None]).T)
+        return 1.0 - similarity.max(axis=1)
+
+    def transform(self, comments):
+        return self.vectorizer.transform(comments)
+
+    def reduce(self, X):
+        # LSA projection of the sparse TF-IDF rows, used for the 2-D layout.
+        return self.svd.transform(X).astype(self.dtype, copy=False)
+
+    def predict(self, comments, track_drift=False):
+        # With track_drift=True, comments is the whole corpus in insertion
+        # order, so every row past the first n_fit_docs arrived after fit().
+        # Their distances replace the running estimate that assign() keeps
+        # between recomputes, which also covers bulk ingestion.
+        X = self.transform(comments)
+        with self._lock:
+            labels = self.kmeans.predict(X)
+            if track_drift:
+                unseen = X[self.n_fit_docs:]
+                self.n_updates = unseen.shape[0]
+                self.update_distance = float(self._distances(unseen).sum()) if unseen.shape[0] else 0.0
+            return labels
+
+    def assign(self, comments, update=False):
+        # Places new comments into the existing themes. With update=True the
+        # centroids also take a MiniBatchKMeans step towards them, and their
+        # distance feeds the drift ratio that decides when a full re-fit is due.
+        X = self.transform(comments)
+        with self._lock:
+            if update:
+                self.kmeans.partial_fit(X)
+            labels = self.kmeans.predict(X)
+            self.n_updates += X.shape[0]
+            self.update_distance += float(self._distances(X).sum())
+        return labels
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with self._lock:
+            joblib.dump({'format': MODEL_FORMAT, 'model': self}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, n_clusters=5):
+        # A missing, truncated or incompatible file (e.g. pickled by another
+        # scikit-learn version) yields an unfitted model, which the worker
+        # simply refits, instead of an error on every page load.
+        try:
+            payload = joblib.load(path)
+            stored = payload['model']
+            current = payload.get('format') == MODEL_FORMAT and stored.n_clusters == n_clusters
+            version = int(stored.version)
+        except FileNotFoundError:
+            return cls(n_clusters=n_clusters)
+        except Exception:
+            logger.exception("Could not load theme model from %s; it will be refitted", path)
+            return cls(n_clusters=n_clusters)
+        if not current:
+            model = cls(n_clusters=n_clusters)
+            model.version = version
+            return model
+        return stored
@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
+from themes import ThemeModel, model_path
+from labeling import LabelingError, get_gpt_labels, previous_labels
+from layout import NeighborIndex, full_layout, place_points, needs_relayout
+from metrics import timed
+from storage import DB_FILE, get_meta, get_versions, load_snapshot, theme_counts, update_themes
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 2.0
+DEBOUNCE_SECONDS = 5.0
+RETRY_SECONDS = 60.0
+
+def cluster_comments(model, comments):
+    if model.is_fitted and not model.needs_refit:
+        labels = model.predict(comments, track_drift=True)
+        if not model.needs_refit:
+            return model, labels
+    # Fit a fresh model so sessions keep assigning against the old one until
+    # the new themes are written back.
+    fresh = ThemeModel(n_clusters=model.n_clusters, n_components=model.n_components, dtype=model.dtype)
+    fresh.version = model.version
+    return fresh, fresh.fit(comments)
+
+def embed_comments(df, features, force=False, db_file=DB_FILE):
+    layout_version = int(get_meta('layout_version', 0, db_file=db_file))
+    coords = df[['x', 'y']].to_numpy(dtype=float)
+    placed = ~pd.isna(coords).any(axis=1)
+    if force or not layout_version or not placed.any() or needs_relayout(int(get_meta('layout_size', 0, db_file=db_file)), len(df)):
+        coords = full_layout(features)
+        return coords, {'layout_version': layout_version + 1, 'layout_size': len(df)}
+    if not placed.all():
+        coords[~placed] = place_points(features[placed], coords[placed], features[~placed])
+    return coords, {}
+
+class ThemeWorker:
+    # Watches comments_version, waits until it has been quiet for
+    # DEBOUNCE_SECONDS, then re-clusters, lays out and labels on its own thread.
+    # Results land in one transaction together with themed_version and
+    # model_version, so the UI always reads a complete, consistent version.
+    def __init__(self, db_file=DB_FILE, n_clusters=5, poll_interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS, client=None):
+        self.db_file = db_file
+        self.client = client
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.model = ThemeModel.load(model_path(db_file), n_clusters=n_clusters)
+        self.busy = False
+        self.last_error = None
+        # provisional() serves from the persisted model as long as it is the
+        # one the stored themes were written with; the neighbour index over
+        # the stored x/y is built on the worker thread at start.
+        self._names = None
+        self._index = None
+        if self.model.is_fitted and get_meta('model_version', db_file=db_file) == str(self.model.version):
+            counts = theme_counts(db_file)
+            self._names = dict(zip(counts['theme'].astype(int), counts['theme_name']))
+        self._force_layout = False
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="theme-worker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def request(self, force_layout=False):
+        self._force_layout = self._force_layout or force_layout
+        self._wake.set()
+
+    @property
+    def updating(self):
+        themed_version = int(get_meta('themed_version', -1, db_file=self.db_file))
+        return self.busy or get_versions(self.db_file)[1] != themed_version
+
+    def _load_index(self):
+        with self._lock:
+            model = self.model if self._names is not None else None
+        if model is None:
+            return
+        _, df = load_snapshot(self.db_file)
+        df = df.dropna(subset=['x', 'y'])
+        if df.empty:
+            return
+        index = NeighborIndex(model.reduce(model.transform(df['comment'].tolist())), df[['x', 'y']].to_numpy(dtype=float))
+        with self._lock:
+            if self._index is None and self.model is model:
+                self._index = index
+
+    def _run(self):
+        try:
+            with timed('load_index'):
+                self._load_index()
+        except Exception:
+            logger.exception("Loading the stored layout failed")
+        seen_version, changed_at = None, 0.0
+        while True:
+            woken = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            comments_version = get_versions(self.db_file)[1]
+            if comments_version != seen_version:
+                seen_version, changed_at = comments_version, time.monotonic()
+            themed_version = int(get_meta('themed_version', -1, db_file=self.db_file))
+            now = time.monotonic()
+            labels_pending = get_meta('labels_pending', '0', db_file=self.db_file) == '1'
+            stale = not self.model.is_fitted or labels_pending or (comments_version != themed_version and now - changed_at >= self.debounce)
+            if woken or (stale and now >= self._retry_at):
+                try:
+                    self.recompute()
+                except Exception as e:
+                    self.last_error = e
+                    self._retry_at = now + RETRY_SECONDS
+                    logger.exception("Theme recompute failed")
+
+    def recompute(self):
+        force_layout, self._force_layout = self._force_layout, False
+        self.busy = True
+        try:
+            with timed('load_comments') as stage:
+                (_, comments_version), df = load_snapshot(self.db_file)
+                stage['items'] = len(df)
+            if df.empty:
+                return
+            comments = df['comment'].tolist()
+            with timed('cluster_comments', items=len(comments)):
+                model, labels = cluster_comments(self.model, comments)
+                features = model.reduce(model.transform(comments))
+            with timed('embed_comments', items=len(comments)):
+                embeddings, layout_meta = embed_comments(df, features, force=force_layout, db_file=self.db_file)
+            # Placeholder names from a failed labelling run must not be carried over.
+            labels_pending = get_meta('labels_pending', '0', db_file=self.db_file) == '1'
+            reuse = {} if labels_pending else previous_labels(labels, df['theme'], df['theme_name'], model.n_clusters)
+            label_error = None
+            with timed('get_gpt_labels', items=model.n_clusters - len(reuse)):
+                try:
+                    theme_names = get_gpt_labels(comments, labels, features, n_clusters=model.n_clusters, reuse=reuse, client=self.client, db_file=self.db_file)
+                except Exception as e:
+                    # Assignments and layout are still written, under the labels
+                    # that did succeed, the previous names or placeholders;
+                    # labels_pending makes the loop retry after RETRY_SECONDS.
+                    logger.exception("Theme labelling failed")
+                    label_error = e
+                    if isinstance(e, LabelingError):
+                        theme_names = e.names
+                    else:
+                        theme_names = [reuse.get(i, f"Theme {i + 1}") for i in range(model.n_clusters)]
+                    self._retry_at = time.monotonic() + RETRY_SECONDS
+            names = np.array(theme_names, dtype=object)[labels]
+            changed = (
+                (df['theme'].to_numpy() != labels)
+                | (df['theme_name'].to_numpy() != names)
+                | (df[['x', 'y']].to_numpy(dtype=float) != embeddings).any(axis=1)
+            )
+            meta = dict(layout_meta, themed_version=comments_version, model_version=model.version, labels_pending=int(label_error is not None))
+            with timed('save_comments', items=int(changed.sum())):
+                update_themes(df['id'][changed], labels[changed], names[changed], embeddings[changed], meta=meta, db_file=self.db_file)
+                model.save(model_path(self.db_file))
+            index = NeighborIndex(features, embeddings)
+            with self._lock:
+                self.model = model
+                self._names = dict(enumerate(theme_names))
+                self._index = index
+            self.last_error = label_error
+        finally:
+            self.busy = False
+
+    def provisional(self, comment, update=False):
+        # Theme and map position for a brand-new comment, taken from the last
+        # completed version so it shows up immediately without a recompute.
+        # The position stays None until the stored layout has been indexed.
+        with self._lock:
+            if self._names is None or not self.model.is_fitted:
+                return None, None, None, None
+            label = int(self.model.assign([comment], update=update)[0])
+            if self._index is None:
+                return label, self._names.get(label), None, None
+            x, y = self._index.place(self.model.reduce(self.model.transform([comment])))[0]
+        return label, self._names.get(label), float(x), float(y)